@@ -1,8 +1,39 @@
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
 import os
+import sys
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wallet.settings')
 
+from django.db import close_old_connections, connection  # noqa: E402
+
+# The IO workers run with -P eventlet, which monkey-patches before the app is loaded;
+# other processes never import eventlet, so don't pull it in just to check.
+EVENTLET_POOL = False
+if 'eventlet' in sys.modules:
+    from eventlet import patcher
+    EVENTLET_POOL = patcher.is_monkey_patched('thread')
+
+if EVENTLET_POOL:
+    # psycopg2 is a C extension eventlet cannot patch; without this every query blocks the hub.
+    from psycogreen.eventlet import patch_psycopg
+    patch_psycopg()
+
 app = Celery('wallet')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@task_prerun.connect
+@task_postrun.connect
+def close_stale_db_connections(**kwargs):
+    # Workers have no request cycle, so recycle persistent connections per task.
+    close_old_connections()
+
+
+@task_postrun.connect
+def close_greenlet_db_connection(**kwargs):
+    # Under eventlet each task runs in a fresh greenlet with its own connection, which
+    # CONN_MAX_AGE would otherwise leave open on pgbouncer after the greenlet is gone.
+    if EVENTLET_POOL:
+        connection.close()
@@ -83,15 +83,34 @@ DATABASES = {
         'NAME': 'wallet_db',
         'USER': 'postgres',
         'PASSWORD': 'postgres',
-        'HOST': 'db',
+        # pgbouncer (transaction pooling) in front of postgres; see docker-compose.yml
+        'HOST': 'pgbouncer',
         'PORT': '5432',
+        'CONN_MAX_AGE': 600,
+        # Server-side cursors do not survive transaction pooling.
+        'DISABLE_SERVER_SIDE_CURSORS': True,
     }
 }
 
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 
+# Unacked messages (including ETA tasks a worker is holding) are redelivered after
+# visibility_timeout seconds. wallets.tasks.ETA_HORIZON must stay below it.
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
+
+# Withdrawals are routed to withdrawals_shard_{wallet_id % N}; keep in sync with the
+# celery_io_worker_* services in docker-compose.yml.
+WITHDRAWAL_QUEUE_SHARDS = 2
+
+# LISTEN does not work through pgbouncer's transaction pooling, so the listen_withdraw
+# command connects to postgres directly.
+WITHDRAWAL_LISTENER_DATABASE = {
+    'HOST': 'db',
+    'PORT': '5432',
+}
+
 CELERY_BEAT_SCHEDULE = {
-    'process-withdrawals-every-minute': {
+    'reconcile-withdrawals-every-minute': {
         'task': 'wallets.tasks.process_scheduled_withdrawals',
         'schedule': schedule(run_every=60.0),
     },
@@ -0,0 +1,53 @@
+import json
+import select
+from datetime import datetime, timezone
+
+import psycopg2
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone as django_timezone
+
+from wallets.tasks import ETA_HORIZON, RECONCILE_GRACE, dispatch_pending_withdrawals, schedule_withdrawal_task
+
+CHANNEL = 'sched_withdraw'
+
+
+class Command(BaseCommand):
+    help = "Dispatch ETA tasks for new scheduled withdrawals from postgres NOTIFY events"
+
+    def handle(self, *args, **options):
+        db = {**settings.DATABASES['default'], **settings.WITHDRAWAL_LISTENER_DATABASE}
+        conn = psycopg2.connect(
+            dbname=db['NAME'],
+            user=db['USER'],
+            password=db['PASSWORD'],
+            host=db['HOST'],
+            port=db['PORT'],
+        )
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        self.stdout.write(f"Listening on channel {CHANNEL}")
+
+        # NOTIFYs sent while the listener was down are gone; re-dispatch what the
+        # reconciliation sweep has not reached yet (older rows are the sweep's).
+        now = django_timezone.now()
+        caught_up = dispatch_pending_withdrawals(now - RECONCILE_GRACE, now + ETA_HORIZON)
+        self.stdout.write(f"Re-dispatched {caught_up} pending withdrawals")
+
+        while True:
+            if select.select([conn], [], [], 60) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                self.dispatch(conn.notifies.pop(0).payload)
+
+    def dispatch(self, payload):
+        withdrawal = json.loads(payload)
+        schedule_withdrawal_task(
+            withdrawal['id'],
+            withdrawal['wallet_id'],
+            datetime.fromtimestamp(withdrawal['scheduled_for'], tz=timezone.utc),
+            task_id=withdrawal['task_id'],
+        )
+        self.stdout.write(f"Dispatched withdrawal {withdrawal['id']}")
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-15 21:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0004_auto_20260216_1143'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledwithdrawal',
+            name='celery_task_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2 on 2026-10-15 21:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0005_scheduledwithdrawal_celery_task_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scheduledwithdrawal',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledwithdrawal',
+            index=models.Index(condition=models.Q(status='pending'), fields=['scheduled_for'], name='sched_pending_idx'),
+        ),
+    ]
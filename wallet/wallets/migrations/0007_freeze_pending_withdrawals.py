@@ -0,0 +1,75 @@
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+
+UNKNOWN_DEBIT_MESSAGE = (
+    'Interrupted in PROCESSING before the freeze_amount migration; '
+    'debit state unknown, needs manual review'
+)
+
+UNCOVERED_PENDING_MESSAGE = (
+    'Cancelled by the freeze_amount migration: available balance did not cover '
+    'this withdrawal once earlier ones were reserved'
+)
+
+
+def freeze_outstanding_withdrawals(apps, schema_editor):
+    """
+    Move outstanding withdrawals onto the freeze_amount reservation scheme.
+
+    PENDING rows were never reserved: freeze them in schedule order while the
+    balance covers them and fail the rest with a migration-specific message.
+
+    PROCESSING rows are left over from the old flow, which flipped the status
+    before debiting the wallet, so a crash may have hit before or after the
+    debit. The old schema keeps no record of it (the withdraw Transaction is
+    only written on bank success), so none of these rows can be proven debited:
+    they are failed without touching the balance and logged for manual review.
+    Run with the Celery workers stopped.
+    """
+    Wallet = apps.get_model('wallets', 'Wallet')
+    ScheduledWithdrawal = apps.get_model('wallets', 'ScheduledWithdrawal')
+
+    wallets = {}
+
+    def wallet_for(withdrawal):
+        if withdrawal.wallet_id not in wallets:
+            wallet = Wallet.objects.get(pk=withdrawal.wallet_id)
+            wallet.freeze_amount = 0
+            wallets[withdrawal.wallet_id] = wallet
+        return wallets[withdrawal.wallet_id]
+
+    for withdrawal in ScheduledWithdrawal.objects.filter(status='processing'):
+        withdrawal.status = 'failed'
+        withdrawal.error_message = UNKNOWN_DEBIT_MESSAGE
+        withdrawal.save(update_fields=['status', 'error_message'])
+        logger.warning(
+            f"Withdrawal {withdrawal.id} ({withdrawal.amount} from wallet {withdrawal.wallet_id}) "
+            f"was PROCESSING with an unknown debit state; marked FAILED for manual review"
+        )
+
+    for withdrawal in ScheduledWithdrawal.objects.filter(status='pending').order_by('scheduled_for', 'id'):
+        wallet = wallet_for(withdrawal)
+        if wallet.balance - wallet.freeze_amount >= withdrawal.amount:
+            wallet.freeze_amount += withdrawal.amount
+        else:
+            withdrawal.status = 'failed'
+            withdrawal.error_message = UNCOVERED_PENDING_MESSAGE
+            withdrawal.save(update_fields=['status', 'error_message'])
+
+    for wallet in wallets.values():
+        wallet.save(update_fields=['freeze_amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0006_scheduledwithdrawal_sched_pending_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(freeze_outstanding_withdrawals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0007_freeze_pending_withdrawals'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE FUNCTION scheduled_withdrawal_notify() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('sched_withdraw', json_build_object(
+                    'id', NEW.id,
+                    'wallet_id', NEW.wallet_id,
+                    'scheduled_for', extract(epoch FROM NEW.scheduled_for),
+                    'task_id', NEW.celery_task_id
+                )::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER scheduled_withdrawal_notify
+            AFTER INSERT ON wallets_scheduledwithdrawal
+            FOR EACH ROW EXECUTE PROCEDURE scheduled_withdrawal_notify();
+            """,
+            reverse_sql="""
+            DROP TRIGGER IF EXISTS scheduled_withdrawal_notify ON wallets_scheduledwithdrawal;
+            DROP FUNCTION IF EXISTS scheduled_withdrawal_notify();
+            """,
+        ),
+    ]
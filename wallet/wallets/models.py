@@ -2,6 +2,7 @@ import uuid
 
 from utils.models import BaseModel
 from django.db import models
+from django.db.models import Q
 from django.core.exceptions import ValidationError
 
 
@@ -47,13 +48,15 @@ class ScheduledWithdrawal(BaseModel):
     wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, related_name='scheduled_withdrawals')
     amount = models.PositiveBigIntegerField()
     scheduled_for = models.DateTimeField(db_index=True)
-    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
     transaction = models.ForeignKey(Transaction, null=True, blank=True, on_delete=models.SET_NULL)
     error_message = models.TextField(null=True, blank=True)
     is_valid = models.BooleanField(default=True)
+    celery_task_id = models.CharField(max_length=255, null=True, blank=True)
 
     class Meta:
         indexes = [
             models.Index(fields=['status', 'scheduled_for']),
             models.Index(fields=['wallet', 'status']),
+            models.Index(fields=['scheduled_for'], name='sched_pending_idx', condition=Q(status='pending')),
         ]
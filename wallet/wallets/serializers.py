@@ -1,6 +1,8 @@
+from django.utils import timezone
 from rest_framework import serializers
 
 from wallets.models import Wallet
+from wallets.services import IRAN_TZ
 
 
 class WalletSerializer(serializers.ModelSerializer):
@@ -10,3 +12,18 @@ class WalletSerializer(serializers.ModelSerializer):
         model = Wallet
         fields = ("uuid", "balance", "freeze_amount", "available_balance")
         read_only_fields = ("uuid", "balance", "freeze_amount", "available_balance")
+
+
+class DepositSerializer(serializers.Serializer):
+    amount = serializers.IntegerField(min_value=1)
+
+
+class ScheduleWithdrawSerializer(serializers.Serializer):
+    amount = serializers.IntegerField(min_value=1)
+    # Naive input (the documented "YYYY-MM-DD HH:MM:SS") is read as Tehran time.
+    scheduled_for = serializers.DateTimeField(input_formats=['iso-8601'], default_timezone=IRAN_TZ)
+
+    def validate_scheduled_for(self, value):
+        if value < timezone.now():
+            raise serializers.ValidationError('Scheduled time cannot be in the past')
+        return value
@@ -1,15 +1,16 @@
 import logging
-import pytz
 from django.db import transaction
 from django.db.models import F
 from django.utils import timezone
-from datetime import datetime
+from datetime import datetime, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+from celery.utils import uuid
 
 from wallets.models import Transaction, Wallet, ScheduledWithdrawal
 
 logger = logging.getLogger(__name__)
 
-IRAN_TZ = pytz.timezone('Asia/Tehran')
+IRAN_TZ = ZoneInfo('Asia/Tehran')
 
 @transaction.atomic
 def deposit_to_wallet(wallet_uuid: str, amount: int) -> Transaction:
@@ -18,8 +19,12 @@ def deposit_to_wallet(wallet_uuid: str, amount: int) -> Transaction:
         raise ValueError("Amount must be positive")
 
     wallet = Wallet.objects.select_for_update().get(uuid=wallet_uuid)
+    Wallet.objects.filter(pk=wallet.pk).update(
+        balance=F('balance') + amount,
+        updated_at=timezone.now(),
+    )
+    # The row is locked, so the in-memory balance stays accurate for the caller.
     wallet.balance += amount
-    wallet.save()
 
     txn = Transaction.objects.create(
         wallet=wallet,
@@ -42,39 +47,42 @@ def create_withdraw_request(wallet_uuid: str, amount: int, scheduled_for: dateti
 
     wallet = Wallet.objects.get(uuid=wallet_uuid)
 
+    # Reserve the amount now; the bank call later either spends or releases the freeze.
+    reserved = Wallet.objects.filter(
+        pk=wallet.pk,
+        balance__gte=F('freeze_amount') + amount,
+    ).update(
+        freeze_amount=F('freeze_amount') + amount,
+        updated_at=timezone.now(),
+    )
+    if not reserved:
+        logger.warning(f"Withdrawal attempt exceeding available balance: {amount} for wallet {wallet_uuid}")
+        raise ValueError("Insufficient available balance")
+
     withdraw_request = ScheduledWithdrawal.objects.create(
         wallet=wallet,
         amount=amount,
         scheduled_for=scheduled_for,
         status=ScheduledWithdrawal.PENDING,
+        celery_task_id=uuid(),
     )
 
-    logger.info(
-        f"Withdrawal scheduled: {amount} from wallet {wallet_uuid} at {scheduled_for}. "
-        f"New frozen amount: {wallet.freeze_amount + amount}"
-    )
+    logger.info(f"Withdrawal scheduled: {amount} from wallet {wallet_uuid} at {scheduled_for}, amount frozen")
     return withdraw_request
 
 
-def schedule_withdrawal_service(wallet_uuid: str, amount: int, scheduled_time_str: str) -> dict:
-
-    if not scheduled_time_str:
-        raise ValueError('time is required (format: HH:MM:SS or HH:MM)')
-
-    try:
-        scheduled_datetime = datetime.strptime(scheduled_time_str, '%Y-%m-%d %H:%M:%S')
-        scheduled_datetime = timezone.make_aware(scheduled_datetime, timezone=IRAN_TZ)
-    except ValueError:
-        raise ValueError('Invalid datetime format. Use YYYY-MM-DD HH:MM:SS')
+def schedule_withdrawal_service(wallet_uuid: str, amount: int, scheduled_datetime: datetime) -> dict:
+    # Convert once at the API boundary; everything downstream (DB, Celery ETA, comparisons) is UTC.
+    scheduled_utc = scheduled_datetime.astimezone(dt_timezone.utc)
 
-    if scheduled_datetime < timezone.now():
+    if scheduled_utc < timezone.now():
         raise ValueError('Scheduled time cannot be in the past')
 
-    withdrawal = create_withdraw_request(wallet_uuid, amount, scheduled_datetime)
+    withdrawal = create_withdraw_request(wallet_uuid, amount, scheduled_utc)
 
     return {
         'wallet_uuid': str(withdrawal.wallet.uuid),
         'amount': withdrawal.amount,
-        'scheduled_for': withdrawal.scheduled_for.strftime('%Y-%m-%d %H:%M:%S'),
+        'scheduled_for': scheduled_datetime.astimezone(IRAN_TZ).strftime('%Y-%m-%d %H:%M:%S'),
         'status': withdrawal.status
     }
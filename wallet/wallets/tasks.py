@@ -1,9 +1,11 @@
 import logging
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
-import pytz
-from django.db import transaction
-from django.db.models import F
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, F, PositiveBigIntegerField, TextField, Value, When
 from django.utils import timezone
 from celery import shared_task
 
@@ -14,63 +16,171 @@ logger = logging.getLogger(__name__)
 
 TIMEOUT = 3
 
+WITHDRAWALS_QUEUE = 'withdrawals_shard_{}'
+
+RECONCILE_GRACE = timedelta(minutes=5)
+
+# Redis redelivers unacked ETA tasks after the broker visibility_timeout (see
+# CELERY_BROKER_TRANSPORT_OPTIONS), so ETA tasks are only sent for rows due within
+# this horizon; the sweep hands rows over as they cross into it.
+ETA_HORIZON = timedelta(minutes=50)
+ETA_HANDOFF_WINDOW = timedelta(minutes=2)
+
+BANK_CALL_CONCURRENCY = 50
+
+RECONCILE_BATCH_SIZE = 200
+
+ClaimedWithdrawal = namedtuple('ClaimedWithdrawal', ['id', 'wallet_id', 'amount'])
+
 
 @shared_task
 def process_scheduled_withdrawals():
-    now = timezone.now().astimezone(pytz.timezone('Asia/Tehran'))
-    current_minute_start = now.replace(second=0, microsecond=0)
-    next_minute_start = current_minute_start + timedelta(minutes=1)
+    """Reconciliation sweep: hand rows entering the ETA horizon to workers, then settle overdue ones in batches."""
+    now = timezone.now()
+    dispatch_pending_withdrawals(now + ETA_HORIZON - ETA_HANDOFF_WINDOW, now + ETA_HORIZON)
 
-    with transaction.atomic():
-        due_withdrawals = ScheduledWithdrawal.objects.select_for_update(
-            skip_locked=True
-        ).filter(
-            status=ScheduledWithdrawal.PENDING,
-            scheduled_for__gte=current_minute_start,
-            scheduled_for__lte=next_minute_start
-        )
+    overdue_before = now - RECONCILE_GRACE
+
+    # Claim and settle one chunk at a time so a crash strands at most one chunk in PROCESSING.
+    while True:
+        withdrawals = _claim_overdue_withdrawals(overdue_before, RECONCILE_BATCH_SIZE)
 
-        withdrawal_ids = list(due_withdrawals.values_list('id', flat=True))
+        if not withdrawals:
+            logger.debug("No overdue withdrawals to reconcile")
+            return
+
+        logger.warning(f"Reconciling {len(withdrawals)} overdue withdrawals")
+
+        # Phase 1: call the bank for the chunk concurrently; the threads never touch the DB.
+        with ThreadPoolExecutor(max_workers=BANK_CALL_CONCURRENCY) as pool:
+            outcomes = list(pool.map(lambda _: _call_bank(), withdrawals))
 
-        if not withdrawal_ids:
-            logger.debug("No due withdrawals to process")
+        # Phase 2: settle the chunk with a handful of set-based writes.
+        succeeded = [w for w, (ok, _) in zip(withdrawals, outcomes) if ok]
+        failed = [(w, error) for w, (ok, error) in zip(withdrawals, outcomes) if not ok]
+        _finalize_success_batch(succeeded)
+        _finalize_failure_batch(failed)
+
+        if len(withdrawals) < RECONCILE_BATCH_SIZE:
             return
 
-        due_withdrawals.update(status=ScheduledWithdrawal.PROCESSING)
-        logger.info(f"Processing {len(withdrawal_ids)} due withdrawals")
 
-    for wid in withdrawal_ids:
-        process_single_withdrawal(wid)
+def withdrawal_queue(wallet_id):
+    # Route by wallet so one wallet's withdrawals always land on the same shard worker.
+    # Settlement is a single F() UPDATE per wallet, so they need no further locking.
+    return WITHDRAWALS_QUEUE.format(wallet_id % settings.WITHDRAWAL_QUEUE_SHARDS)
+
+
+def schedule_withdrawal_task(withdrawal_id, wallet_id, scheduled_for, task_id=None):
+    if scheduled_for > timezone.now() + ETA_HORIZON:
+        logger.debug(f"Withdrawal {withdrawal_id} is beyond the ETA horizon; left to the sweep")
+        return
+    process_single_withdrawal.apply_async(
+        args=[withdrawal_id],
+        eta=scheduled_for,
+        queue=withdrawal_queue(wallet_id),
+        task_id=task_id,
+    )
+
+
+def dispatch_pending_withdrawals(scheduled_after, scheduled_before):
+    """Send ETA tasks for PENDING rows due in ``(scheduled_after, scheduled_before]``; the claim drops duplicates."""
+    pending = ScheduledWithdrawal.objects.filter(
+        status=ScheduledWithdrawal.PENDING,
+        scheduled_for__gt=scheduled_after,
+        scheduled_for__lte=scheduled_before,
+    ).values_list('id', 'wallet_id', 'scheduled_for', 'celery_task_id')
+
+    for withdrawal_id, wallet_id, scheduled_for, task_id in pending:
+        schedule_withdrawal_task(withdrawal_id, wallet_id, scheduled_for, task_id=task_id)
+    return len(pending)
+
+
+def _claim_overdue_withdrawals(overdue_before, limit):
+    """Flip up to ``limit`` overdue PENDING rows to PROCESSING and return them as ``ClaimedWithdrawal`` tuples."""
+    table = ScheduledWithdrawal._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table}
+            SET status = %s, updated_at = %s
+            WHERE id IN (
+                SELECT id FROM {table}
+                WHERE status = %s AND scheduled_for <= %s
+                ORDER BY scheduled_for
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, wallet_id, amount
+            """,
+            [
+                ScheduledWithdrawal.PROCESSING,
+                timezone.now(),
+                ScheduledWithdrawal.PENDING,
+                overdue_before,
+                limit,
+            ],
+        )
+        return [ClaimedWithdrawal(*row) for row in cursor.fetchall()]
+
+
+def _claim_withdrawal(withdrawal_id):
+    # Both the ETA task and the reconciliation sweep may deliver the same id; only one claim wins.
+    return ScheduledWithdrawal.objects.filter(
+        id=withdrawal_id,
+        status=ScheduledWithdrawal.PENDING,
+    ).update(
+        status=ScheduledWithdrawal.PROCESSING,
+        updated_at=timezone.now(),
+    ) > 0
 
 
 def _fetch_withdrawal(withdrawal_id):
     return ScheduledWithdrawal.objects.filter(
         id=withdrawal_id,
         status=ScheduledWithdrawal.PROCESSING,
-    ).select_related('wallet').first()
+    ).select_related('wallet').only(
+        'amount', 'wallet__uuid', 'wallet__balance', 'wallet__freeze_amount',
+    ).first()
 
 
-def _deduct_balance(withdrawal):
-    with transaction.atomic():
-        updated = Wallet.objects.filter(
-            id=withdrawal.wallet_id,
-            balance__gte=withdrawal.amount,
-        ).update(
-            balance=F('balance') - withdrawal.amount,
-        )
-    return updated > 0
+def _mark_failed(withdrawal_id, error_message):
+    ScheduledWithdrawal.objects.filter(pk=withdrawal_id).update(
+        status=ScheduledWithdrawal.FAILED,
+        error_message=error_message,
+        updated_at=timezone.now(),
+    )
+
+
+def _call_bank():
+    """Return ``(bank_success, error_message)`` for one bank call."""
+    try:
+        response = request_third_party_deposit(timeout=TIMEOUT)
+    except Exception as e:
+        return False, f'Unexpected error: {str(e)} - reserved amount released'
+
+    if response.get('data') == 'success':
+        return True, None
+    return False, f'Bank rejected the request. Response: {response}'
 
 
 def _finalize_success(withdrawal):
     with transaction.atomic():
+        Wallet.objects.filter(id=withdrawal.wallet_id).update(
+            balance=F('balance') - withdrawal.amount,
+            freeze_amount=F('freeze_amount') - withdrawal.amount,
+            updated_at=timezone.now(),
+        )
         tx = Transaction.objects.create(
-            wallet=withdrawal.wallet,
+            wallet_id=withdrawal.wallet_id,
             amount=withdrawal.amount,
             type=Transaction.WITHDRAW,
         )
-        withdrawal.status = ScheduledWithdrawal.COMPLETED
-        withdrawal.transaction = tx
-        withdrawal.save()
+        ScheduledWithdrawal.objects.filter(pk=withdrawal.pk).update(
+            status=ScheduledWithdrawal.COMPLETED,
+            transaction_id=tx.pk,
+            updated_at=timezone.now(),
+        )
     logger.info(
         f"Withdrawal {withdrawal.id} completed successfully: {withdrawal.amount} "
         f"from wallet {withdrawal.wallet.uuid}"
@@ -80,78 +190,97 @@ def _finalize_success(withdrawal):
 def _finalize_failure(withdrawal, error_message):
     with transaction.atomic():
         Wallet.objects.filter(id=withdrawal.wallet_id).update(
-            balance=F('balance') + withdrawal.amount
+            freeze_amount=F('freeze_amount') - withdrawal.amount,
+            updated_at=timezone.now(),
         )
-        withdrawal.status = ScheduledWithdrawal.FAILED
-        withdrawal.error_message = error_message
-        withdrawal.save()
+        _mark_failed(withdrawal.pk, error_message)
     logger.error(
         f"Withdrawal {withdrawal.id} failed: {error_message}. "
-        f"Amount refunded to wallet {withdrawal.wallet.uuid}"
+        f"Reserved amount released on wallet {withdrawal.wallet.uuid}"
     )
 
 
-def process_single_withdrawal(withdrawal_id):
-    withdrawal = _fetch_withdrawal(withdrawal_id)
-
-    if not withdrawal:
-        logger.warning(f"Withdrawal {withdrawal_id} not found or not in PROCESSING state")
-        return
-
-    logger.info(
-        f"Processing withdrawal {withdrawal_id}: {withdrawal.amount} from wallet {withdrawal.wallet.uuid} "
-        f"(current balance: {withdrawal.wallet.balance})"
+def _amount_per_wallet(withdrawals):
+    totals = defaultdict(int)
+    for withdrawal in withdrawals:
+        totals[withdrawal.wallet_id] += withdrawal.amount
+    return totals, Case(
+        *[When(id=wallet_id, then=Value(amount)) for wallet_id, amount in totals.items()],
+        output_field=PositiveBigIntegerField(),
     )
 
-    if withdrawal.wallet.balance - withdrawal.amount < 0:
-        withdrawal.status = ScheduledWithdrawal.FAILED
-        withdrawal.error_message = 'Insufficient balance: wallet balance would reach zero or below'
-        withdrawal.save()
-        logger.warning(
-            f"Withdrawal {withdrawal_id} failed: balance after withdrawal would be "
-            f"{withdrawal.wallet.balance - withdrawal.amount} for wallet {withdrawal.wallet.uuid}"
-        )
+
+def _finalize_success_batch(withdrawals):
+    if not withdrawals:
         return
+    totals, amount = _amount_per_wallet(withdrawals)
 
-    if not _deduct_balance(withdrawal):
-        withdrawal.status = ScheduledWithdrawal.FAILED
-        withdrawal.error_message = 'Insufficient balance at execution time'
-        withdrawal.save()
-        logger.warning(
-            f"Withdrawal {withdrawal_id} failed: Insufficient balance at execution time "
-            f"for wallet {withdrawal.wallet.uuid}"
+    with transaction.atomic():
+        Wallet.objects.filter(id__in=totals).update(
+            balance=F('balance') - amount,
+            freeze_amount=F('freeze_amount') - amount,
+            updated_at=timezone.now(),
         )
+        txs = Transaction.objects.bulk_create([
+            Transaction(wallet_id=w.wallet_id, amount=w.amount, type=Transaction.WITHDRAW)
+            for w in withdrawals
+        ])
+        ScheduledWithdrawal.objects.filter(id__in=[w.id for w in withdrawals]).update(
+            status=ScheduledWithdrawal.COMPLETED,
+            transaction_id=Case(
+                *[When(id=w.id, then=Value(tx.pk)) for w, tx in zip(withdrawals, txs)],
+                output_field=BigIntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+    logger.info(f"Completed {len(withdrawals)} withdrawals: {[w.id for w in withdrawals]}")
+
+
+def _finalize_failure_batch(failures):
+    if not failures:
         return
+    totals, amount = _amount_per_wallet([w for w, _ in failures])
 
-    try:
-        process_bank_call.delay(withdrawal_id)
-    except Exception as e:
+    with transaction.atomic():
+        Wallet.objects.filter(id__in=totals).update(
+            freeze_amount=F('freeze_amount') - amount,
+            updated_at=timezone.now(),
+        )
+        ScheduledWithdrawal.objects.filter(id__in=[w.id for w, _ in failures]).update(
+            status=ScheduledWithdrawal.FAILED,
+            error_message=Case(
+                *[When(id=w.id, then=Value(error)) for w, error in failures],
+                output_field=TextField(),
+            ),
+            updated_at=timezone.now(),
+        )
+    wallet_uuids = dict(Wallet.objects.filter(id__in=totals).values_list('id', 'uuid'))
+    for withdrawal, error in failures:
         logger.error(
-            f"Withdrawal {withdrawal_id}: failed to queue bank call ({e}). Refunding."
+            f"Withdrawal {withdrawal.id} failed: {error}. "
+            f"Reserved amount released on wallet {wallet_uuids[withdrawal.wallet_id]}"
         )
-        _finalize_failure(withdrawal, f"Failed to queue bank call: {str(e)}")
 
 
 @shared_task
-def process_bank_call(withdrawal_id):
+def process_single_withdrawal(withdrawal_id):
+    if not _claim_withdrawal(withdrawal_id):
+        logger.info(f"Withdrawal {withdrawal_id} already claimed or no longer pending")
+        return
+
     withdrawal = _fetch_withdrawal(withdrawal_id)
 
     if not withdrawal:
-        logger.warning(f"Bank call aborted: withdrawal {withdrawal_id} not found or not in PROCESSING state")
+        logger.warning(f"Withdrawal {withdrawal_id} not found or not in PROCESSING state")
         return
 
-    bank_success = False
-    error_message = None
-
-    try:
-        response = request_third_party_deposit()
-        bank_success = response.get('data') == 'success'
-
-        if not bank_success:
-            error_message = f'Bank rejected the request. Response: {response}'
+    logger.info(
+        f"Processing withdrawal {withdrawal_id}: {withdrawal.amount} from wallet {withdrawal.wallet.uuid} "
+        f"(current balance: {withdrawal.wallet.balance}, frozen: {withdrawal.wallet.freeze_amount})"
+    )
 
-    except Exception as e:
-        error_message = f'Unexpected error: {str(e)} - withdrawal amount refunded'
+    # The amount stays frozen across the bank call; no transaction is held open meanwhile.
+    bank_success, error_message = _call_bank()
 
     if bank_success:
         _finalize_success(withdrawal)
@@ -1,6 +1,20 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# Shared keep-alive session so bank calls reuse pooled connections instead of
+# opening a new one per withdrawal. POST is not in Retry's default allowed
+# methods, so only connection failures (request never sent) are retried.
+_adapter = HTTPAdapter(
+    pool_connections=50,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.1),
+)
+session = requests.Session()
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
 
-def request_third_party_deposit():
-    response = requests.post("http://172.18.0.1:8010/")
+
+def request_third_party_deposit(timeout=None):
+    response = session.post("http://172.18.0.1:8010/", timeout=timeout)
     return response.json()
@@ -3,7 +3,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from wallets.models import Wallet
-from wallets.serializers import WalletSerializer
+from wallets.serializers import DepositSerializer, ScheduleWithdrawSerializer, WalletSerializer
 from wallets.services import deposit_to_wallet, schedule_withdrawal_service
 
 class CreateWalletView(CreateAPIView):
@@ -19,9 +19,12 @@ class RetrieveWalletView(RetrieveAPIView):
 class CreateDepositView(APIView):
     def post(self, request, *args, **kwargs):
         wallet_uuid = kwargs.get('uuid')
-        amount = request.data.get('amount', 0)
+        serializer = DepositSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': serializer.errors}, status=400)
+
         try:
-            txn = deposit_to_wallet(wallet_uuid, amount)
+            txn = deposit_to_wallet(wallet_uuid, serializer.validated_data['amount'])
 
             return Response({
                 'wallet_uuid': str(txn.wallet.uuid),
@@ -38,11 +41,16 @@ class CreateDepositView(APIView):
 class ScheduleWithdrawView(APIView):
     def post(self, request, *args, **kwargs):
         wallet_uuid = kwargs.get('uuid')
-        amount = request.data.get('amount', 0)
-        scheduled_time = request.data.get('scheduled_for')
+        serializer = ScheduleWithdrawSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': serializer.errors}, status=400)
 
         try:
-            response_data = schedule_withdrawal_service(wallet_uuid, amount, scheduled_time)
+            response_data = schedule_withdrawal_service(
+                wallet_uuid,
+                serializer.validated_data['amount'],
+                serializer.validated_data['scheduled_for'],
+            )
             return Response(response_data, status=201)
 
         except ValueError as e: